@@ -1,19 +1,47 @@
 #!/usr/bin/env python3
 """
 chng.py - Simple AI-powered changelog generator
-Usage: python chng.py <diff_file> or python chng.py --setup
+Usage: python chng.py [--no-cache] [--json] [--batch] <diff_file>... or python chng.py --setup
 """
 
+import sys
+
+USAGE = """Usage: chng [--no-cache] [--json] [--batch] <diff_file>...
+       chng --setup
+
+Options:
+  --setup      Configure API settings
+  --no-cache   Regenerate instead of reusing cached changelogs
+  --json       Write the changelog as JSON instead of markdown
+  --batch      Send several diffs per request (needs a /completions endpoint)
+  -h, --help   Show this message
+"""
+
+# Answer bare and help invocations before importing anything else
+if __name__ == "__main__" and (len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help")):
+    if len(sys.argv) < 2:
+        sys.stderr.write(USAGE)
+        sys.exit(1)
+    sys.stdout.write(USAGE)
+    sys.exit(0)
+
+import argparse
+import asyncio
+import hashlib
 import json
+import mmap
 import os
-import sys
+import random
+import re
+import socket
+import stat
+import time
 from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
 
 try:
-    import openai
     from rich.console import Console
-    from rich.prompt import Prompt
-    from rich.progress import Progress, SpinnerColumn, TextColumn
+    from rich.markup import escape
 except ImportError as e:
     print(f"Missing dependency: {e}")
     print("Install with: pip install openai rich")
@@ -21,32 +49,333 @@ except ImportError as e:
 
 console = Console()
 
+# Config is parsed on every run, so use the faster orjson when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_loads(data):
+    """Parse JSON from bytes"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj):
+    """Serialize to indented JSON bytes"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode()
+
+# openai is slow to import, so it is only loaded once a request is made
+openai = None
+
+def load_openai():
+    """Import openai on first use"""
+    global openai
+    if openai is None:
+        try:
+            import openai
+        except ImportError as e:
+            print(f"Missing dependency: {e}")
+            print("Install with: pip install openai rich")
+            sys.exit(1)
+    return openai
+
+SEPARATOR = "=" * 60
+
+# Maximum number of requests in flight when processing several files
+MAX_CONCURRENCY = 4
+
+# Diffs larger than this are trimmed to their code changes before prompting
+MAX_DIFF_TOKENS = 12000
+
+# Rate limits, server errors and dropped connections are retried with
+# exponential backoff. Clients are built with max_retries=0 so this is the
+# only retry layer.
+MAX_ATTEMPTS = 5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Generated changelogs are cached here, keyed by model, prompt and diff
+CACHE_DIR = Path.home() / ".cache" / "chng"
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Instructions go in a fixed system message ahead of the diff, so servers that
+# cache prompt prefixes (such as OpenAI) can reuse them across requests
+SYSTEM_PROMPT = """You are an expert software developer writing a changelog entry.
+
+Given the git diff in the user message, create a concise, well-formatted changelog entry in markdown format.
+
+Guidelines:
+- Use clear, user-facing language
+- Group related changes together
+- Use bullet points for multiple changes
+- Follow conventional changelog format (Added, Changed, Fixed, Removed, etc.)
+- Use a "## " heading for each group"""
+
+SYSTEM_PROMPT_JSON = """You are an expert software developer writing a changelog entry.
+
+Given the git diff in the user message, describe its changes as a JSON object with exactly these keys:
+"added", "changed", "deprecated", "removed", "fixed", "security"
+
+Each key maps to a list of short strings, one per change, and is an empty list when there are no such changes.
+
+Guidelines:
+- Use clear, user-facing language
+- Group related changes together
+
+Reply with the JSON object only."""
+
+# Plain-text prompt for the legacy completions endpoint used by --batch, which
+# takes no chat template, so the diff and answer are laid out as a document
+COMPLETION_PROMPT_HEAD = """Below is a git diff followed by a concise, well-formatted changelog entry for it in markdown format, written by an expert software developer.
+
+Guidelines:
+- Use clear, user-facing language
+- Group related changes together
+- Use bullet points for multiple changes
+- Follow conventional changelog format (Added, Changed, Fixed, Removed, etc.)
+- Use a "## " heading for each group
+
+Diff:
+```diff
+"""
+COMPLETION_PROMPT_TAIL = """
+```
+
+Changelog entry:
+"""
+COMPLETION_STOP = ["\nDiff:"]
+
+# Bump whenever the prompt changes so old cache entries are not reused
+PROMPT_VERSION = 4
+
+# Per-file sections of recent diffs, used to regenerate only what changed
+STEPS_FILE = CACHE_DIR / "steps.json"
+STEPS_MAX = 100
+
+# Endpoints known not to accept several prompts in one completions request
+ENDPOINTS_FILE = CACHE_DIR / "endpoints.json"
+BATCH_SIZE = 16
+
+# Patterns for taking diffs apart, compiled once. The bytes patterns run
+# directly on mapped diff files so large diffs are never decoded whole.
+FILE_SPLIT_RE = re.compile(r"^(?=diff --git )", re.M)
+FILE_START_RE = re.compile(rb"^diff --git ", re.M)
+CHANGE_LINE_RE = re.compile(rb"^[+-](?!\+\+ |-- )", re.M)
+NOISE_LINE_RE = re.compile(
+    rb"^(index [0-9a-f]+\.\.[0-9a-f]+.*|similarity index .*|Binary files .* differ)\n?",
+    re.M
+)
+
+def retry_delay(error, attempt):
+    """Seconds to wait before retrying a failed request, or None to give up"""
+    if attempt >= MAX_ATTEMPTS - 1:
+        return None
+    openai = load_openai()
+    delay = min(2 ** attempt, 30) + random.random()
+    if isinstance(error, openai.APIConnectionError):
+        return delay
+    if not isinstance(error, openai.APIStatusError):
+        return None
+    if error.status_code not in RETRY_STATUSES:
+        return None
+    
+    # Honour the server's own wait when it gives one in seconds
+    try:
+        return max(delay, min(float(error.response.headers.get("retry-after", 0)), 60))
+    except ValueError:
+        return delay
+
+def normalize_diff(diff_content):
+    """Reduce a diff to the lines that matter for its changelog"""
+    lines = []
+    for line in diff_content.splitlines():
+        # Hunk headers and index lines only carry line numbers and blob hashes
+        if line.startswith(("@@", "index ")):
+            continue
+        line = " ".join(line.split())
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+def split_diff(diff_content):
+    """Split a diff into its per-file sections"""
+    sections = FILE_SPLIT_RE.split(diff_content)
+    return [section for section in sections if section.strip()]
+
+def diff_sections(buffer):
+    """Yield (start, end) offsets of the per-file sections of a diff buffer"""
+    start = 0
+    for match in FILE_START_RE.finditer(buffer):
+        if match.start() > start:
+            yield start, match.start()
+        start = match.start()
+    if start < len(buffer):
+        yield start, len(buffer)
+
+def merge_changelogs(base, extra):
+    """Merge the sections of one markdown changelog into another"""
+    def parse(changelog):
+        # Sections are keyed by title so "## Added" and "### Added" match
+        sections = {"": ("", [])}
+        title = ""
+        for line in changelog.splitlines():
+            if line.startswith("#"):
+                title = line.lstrip("#").strip().rstrip(":").lower()
+                sections.setdefault(title, (line, []))
+            else:
+                sections[title][1].append(line)
+        return sections
+    
+    merged = parse(base)
+    for title, (heading, lines) in parse(extra).items():
+        existing = merged.setdefault(title, (heading, []))[1]
+        # Drop the blank line that separated this section from the next
+        while existing and not existing[-1].strip():
+            existing.pop()
+        existing.extend(line for line in lines if line.strip() and line not in existing)
+    
+    output = []
+    for heading, lines in merged.values():
+        while lines and not lines[-1].strip():
+            lines.pop()
+        if heading:
+            if output:
+                output.append("")
+            output.append(heading)
+        output.extend(lines)
+    return "\n".join(output).strip()
+
+def count_tokens(text, model):
+    """Count the tokens in text, estimating when tiktoken is unavailable"""
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        return len(encoding.encode(text, disallowed_special=()))
+    except Exception:
+        # Roughly four characters per token for code
+        return len(text) // 4
+
+def decode_diff(data):
+    """Decode diff bytes leniently, with universal newlines like text mode"""
+    text = str(data, 'utf-8', 'replace')
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+def summarize_diff(buffer, model, max_tokens=MAX_DIFF_TOKENS):
+    """Decode a diff buffer, trimming it to its code changes to fit in max_tokens
+    
+    Returns the diff text and whether anything was trimmed. Only the parts
+    that are kept get copied out of the buffer, so it can be an mmap.
+    """
+    # Every token is at least one byte, so a diff this small always fits
+    if len(buffer) <= max_tokens:
+        return decode_diff(buffer).strip(), False
+    
+    # Anything this size might fit, so check the whole diff first
+    if len(buffer) <= max_tokens * 8:
+        text = decode_diff(buffer).strip()
+        if count_tokens(text, model) <= max_tokens:
+            return text, False
+    
+    # Find per-file sections and keep those with added or removed lines
+    sections = list(diff_sections(buffer))
+    sections = [
+        (start, end) for start, end in sections
+        if CHANGE_LINE_RE.search(buffer, start, end)
+    ] or sections
+    
+    # A file is only worth keeping with its header and at least one change
+    minimums = []
+    for start, end in sections:
+        match = CHANGE_LINE_RE.search(buffer, start, end)
+        line_end = buffer.find(b"\n", match.start(), end) if match else -1
+        minimums.append((end if line_end < 0 else line_end + 1) - start)
+    
+    # Share the budget fairly: small files are kept whole, large ones truncated,
+    # and files whose share can't hold their minimum are dropped
+    marker = b"\n... (truncated)\n"
+    order = sorted(range(len(sections)), key=lambda i: sections[i][1] - sections[i][0])
+    budget = max_tokens * 4
+    text = ""
+    while budget > 0:
+        remaining = budget
+        keeps = [None] * len(sections)
+        for rank, i in enumerate(order):
+            start, end = sections[i]
+            share = max(remaining, 0) // (len(sections) - rank)
+            if share >= end - start:
+                keeps[i] = end - start
+                remaining -= end - start
+            elif share - len(marker) >= minimums[i]:
+                keeps[i] = share - len(marker)
+                remaining -= share
+        
+        # Nothing fits whole, so fall back to the start of the smallest file
+        if not any(keeps):
+            keeps[order[0]] = max(budget - len(marker), 0)
+        
+        trimmed = []
+        for (start, end), keep in zip(sections, keeps):
+            if keep is None:
+                continue
+            section = NOISE_LINE_RE.sub(b"", buffer[start:start + keep])
+            if keep < end - start:
+                cut = section.rfind(b"\n")
+                section = section[:cut + 1 if cut >= 0 else len(section)] + marker[1:]
+            trimmed.append(section)
+        text = decode_diff(b"".join(trimmed)).strip()
+        
+        # Bytes per token varies, so shrink the budget until the result fits
+        tokens = count_tokens(text, model)
+        if tokens <= max_tokens:
+            break
+        budget = min(int(budget * max_tokens / tokens * 0.95), budget - 1)
+    return text, True
+
 class ChngApp:
     def __init__(self):
         self.config_file = Path.home() / ".apikey"
         self.config = self.load_config()
+        self.use_cache = True
+        self.json_output = False
+        self.batch_prompts = False
+        # Reused between calls so its connection pool keeps connections alive
+        self._client = None
+        self._client_settings = None
         
     def load_config(self):
         """Load API configuration from .apikey file"""
         if self.config_file.exists():
             try:
-                with open(self.config_file, 'r') as f:
-                    return json.load(f)
+                with open(self.config_file, 'rb') as f:
+                    return json_loads(f.read())
             except:
                 return {}
         return {}
     
     def save_config(self):
         """Save API configuration to .apikey file"""
+        # Create the file as 0600 up front so the key is never readable by others,
+        # then swap it in so a crash can't leave a half-written config
+        tmp = self.config_file.with_name(self.config_file.name + ".tmp")
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.config, f, indent=2)
-            os.chmod(self.config_file, 0o600)
+            # A leftover temp file could have looser permissions, so never reuse it
+            tmp.unlink(missing_ok=True)
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json_dumps(self.config))
+            os.replace(tmp, self.config_file)
         except Exception as e:
             console.print(f"[red]Error saving config: {e}[/red]")
     
     def setup(self):
         """Setup API configuration"""
+        from rich.prompt import Prompt
+        
         console.clear()
         console.print("[bold blue]API Configuration Setup[/bold blue]\n")
         
@@ -86,6 +415,7 @@ class ChngApp:
             'key': key,
             'model': model
         }
+        self._client = None
         
         # Warn about empty values
         warnings = []
@@ -112,7 +442,10 @@ class ChngApp:
             console.print("[red]✗ Connection failed. Please check your settings.[/red]")
     
     def get_api_url(self):
-        """Construct full API URL from config"""
+        """Construct full API URL from config
+        
+        Raises ValueError if the URL has a malformed port or host.
+        """
         url = self.config.get('url', '').rstrip('/')
         port = self.config.get('port', '')
         
@@ -120,13 +453,19 @@ class ChngApp:
             return None
             
         # If port is specified separately and not already in URL
-        if port and f":{port}" not in url:
-            # Extract protocol and host
-            if "://" in url:
-                protocol, rest = url.split("://", 1)
-                host = rest.split("/")[0].split(":")[0]
-                path = "/" + "/".join(rest.split("/")[1:]) if "/" in rest else ""
-                url = f"{protocol}://{host}:{port}{path}"
+        if port:
+            parts = urlsplit(url)
+            if parts.hostname and str(parts.port) != str(port):
+                host = parts.hostname
+                if ":" in host:
+                    host = f"[{host}]"
+                netloc = f"{host}:{port}"
+                if parts.username:
+                    userinfo = parts.username
+                    if parts.password:
+                        userinfo += f":{parts.password}"
+                    netloc = f"{userinfo}@{netloc}"
+                url = urlunsplit(parts._replace(netloc=netloc))
         
         return url
     
@@ -137,7 +476,20 @@ class ChngApp:
             if not client:
                 return False
             
+            # Fail fast if nothing is listening at all
+            parts = urlsplit(self.get_api_url())
+            port = parts.port or (443 if parts.scheme == "https" else 80)
+            socket.create_connection((parts.hostname, port), timeout=2).close()
+            
+            # Listing models is much cheaper than a completion, but only proves
+            # the model exists if the server actually lists it
             model = self.config.get('model', 'gpt-3.5-turbo')
+            try:
+                if model in {m.id for m in client.models.list()}:
+                    return True
+            except:
+                pass
+            
             response = client.chat.completions.create(
                 model=model,
                 messages=[{"role": "user", "content": "test"}],
@@ -147,9 +499,13 @@ class ChngApp:
         except:
             return False
     
-    def get_client(self):
-        """Get OpenAI client with current configuration"""
-        api_url = self.get_api_url()
+    def get_client_settings(self):
+        """Get (url, key) for the API client, or None if not configured"""
+        try:
+            api_url = self.get_api_url()
+        except ValueError as e:
+            console.print(f"[red]Error: Invalid API URL ({e}). Run with --setup[/red]")
+            return None
         api_key = self.config.get('key', '')
         
         if not api_url:
@@ -160,73 +516,446 @@ class ChngApp:
             # For local servers, use dummy key
             api_key = "dummy"
         
-        return openai.OpenAI(
-            base_url=api_url,
-            api_key=api_key
-        )
+        return api_url, api_key
+    
+    def get_client(self):
+        """Get OpenAI client with current configuration"""
+        settings = self.get_client_settings()
+        if not settings:
+            return None
+        
+        if self._client is None or self._client_settings != settings:
+            api_url, api_key = settings
+            self._client = load_openai().OpenAI(
+                base_url=api_url,
+                api_key=api_key,
+                max_retries=0
+            )
+            self._client_settings = settings
+        return self._client
+    
+    def cache_key(self, diff_content):
+        """Hash a diff together with the current model, prompt and output format"""
+        model = self.config.get('model', 'gpt-3.5-turbo')
+        output = "json" if self.json_output else "markdown"
+        return hashlib.blake2b(
+            f"{model}\0{PROMPT_VERSION}\0{output}\0{diff_content}".encode(),
+            digest_size=16
+        ).hexdigest()
+    
+    def cache_path(self, diff_content):
+        """Get the cache file for a diff under the current model and prompt"""
+        return CACHE_DIR / f"{self.cache_key(diff_content)}.md"
+    
+    def load_cached(self, diff_content):
+        """Return a previously generated changelog for this diff, if any"""
+        if not self.use_cache:
+            return None
+        
+        # Exact match first, then the same diff modulo line numbers and whitespace
+        for text in (diff_content, normalize_diff(diff_content)):
+            path = self.cache_path(text)
+            try:
+                changelog = path.read_text(encoding='utf-8')
+                # Touch the entry so eviction treats it as recently used
+                os.utime(path)
+            except OSError:
+                continue
+            return changelog
+        return None
+    
+    def store_cached(self, diff_content, changelog):
+        """Save a generated changelog to the cache"""
+        if not self.use_cache:
+            return
+        
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            for text in (diff_content, normalize_diff(diff_content)):
+                path = self.cache_path(text)
+                tmp = path.with_suffix(".tmp")
+                tmp.write_text(changelog, encoding='utf-8')
+                tmp.replace(path)
+            self.evict_cache()
+        except OSError:
+            pass
+    
+    def evict_cache(self):
+        """Remove least recently used cache entries above CACHE_MAX_BYTES"""
+        entries = []
+        for path in CACHE_DIR.glob("*.md"):
+            try:
+                entries.append((path.stat(), path))
+            except OSError:
+                continue
+        
+        total = sum(info.st_size for info, _ in entries)
+        for info, path in sorted(entries, key=lambda entry: entry[0].st_mtime):
+            if total <= CACHE_MAX_BYTES:
+                break
+            path.unlink(missing_ok=True)
+            total -= info.st_size
+    
+    def load_steps(self):
+        """Load recorded per-file sections of previous diffs"""
+        try:
+            with open(STEPS_FILE, 'rb') as f:
+                return json_loads(f.read())
+        except:
+            return []
+    
+    def store_steps(self, diff_content, changelog):
+        """Record which per-file sections a changelog was generated from"""
+        # Partial regeneration merges markdown sections, so JSON output opts out
+        if not self.use_cache or self.json_output:
+            return
+        
+        keys = sorted({self.cache_key(normalize_diff(section)) for section in split_diff(diff_content)})
+        steps = [step for step in self.load_steps() if step.get('sections') != keys]
+        steps.append({'sections': keys, 'changelog': changelog})
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = STEPS_FILE.with_suffix(".tmp")
+            with open(tmp, 'wb') as f:
+                f.write(json_dumps(steps[-STEPS_MAX:]))
+            tmp.replace(STEPS_FILE)
+        except OSError:
+            pass
+    
+    def plan_generation(self, diff_content):
+        """Work out what has to be sent to the model for a diff
+        
+        Returns the diff text to generate from and, when an earlier changelog
+        already covers some of its files unchanged, that changelog to merge into.
+        """
+        if not self.use_cache or self.json_output:
+            return diff_content, None
+        
+        sections = split_diff(diff_content)
+        keys = [self.cache_key(normalize_diff(section)) for section in sections]
+        
+        # Pick the earlier diff covering the most files, all still unchanged
+        best = None
+        for step in self.load_steps():
+            covered = set(step.get('sections', []))
+            if not covered or not covered.issubset(keys) or covered == set(keys):
+                continue
+            if best is None or len(covered) > len(best[0]):
+                best = (covered, step['changelog'])
+        
+        if best is None:
+            return diff_content, None
+        
+        covered, changelog = best
+        missing = [section for section, key in zip(sections, keys) if key not in covered]
+        return "".join(missing).strip(), changelog
+    
+    def finish_generation(self, diff_content, base, changelog):
+        """Merge a generated changelog into its base and cache the result"""
+        if self.json_output:
+            try:
+                changelog = json_dumps(json_loads(changelog)).decode()
+            except ValueError:
+                console.print("[red]Error: API did not return valid JSON[/red]")
+                return None
+        
+        if base:
+            changelog = merge_changelogs(base, changelog)
+        self.store_cached(diff_content, changelog)
+        self.store_steps(diff_content, changelog)
+        return changelog
+    
+    def build_messages(self, diff_content):
+        """Build the chat messages asking for a diff's changelog"""
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT_JSON if self.json_output else SYSTEM_PROMPT},
+            {"role": "user", "content": f"```diff\n{diff_content}\n```"}
+        ]
+    
+    def completion_options(self):
+        """Get the request options shared by all changelog completions"""
+        options = {
+            'model': self.config.get('model', 'gpt-3.5-turbo'),
+            'max_tokens': 1000,
+            'temperature': 0.3
+        }
+        if self.json_output:
+            options['response_format'] = {"type": "json_object"}
+        return options
+    
+    def create_completion(self, create, **kwargs):
+        """Call a completion endpoint, retrying transient failures"""
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return create(**kwargs)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+    
+    async def create_completion_async(self, create, **kwargs):
+        """Call an async completion endpoint, retrying transient failures"""
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return await create(**kwargs)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
     
     def generate_changelog(self, diff_content):
-        """Generate changelog from diff content"""
-        prompt = f"""You are an expert software developer writing a changelog entry.
-
-Given this git diff, create a concise, well-formatted changelog entry in markdown format.
-
-Guidelines:
-- Use clear, user-facing language
-- Group related changes together
-- Use bullet points for multiple changes
-- Follow conventional changelog format (Added, Changed, Fixed, Removed, etc.)
-
-Diff:
-```
-{diff_content}
-```
-
-Generate a changelog entry:"""
-
+        """Generate changelog from diff content, showing it as it arrives"""
+        cached = self.load_cached(diff_content)
+        if cached is not None:
+            console.print("[dim]Using cached changelog[/dim]")
+            self.show_changelog(cached)
+            return cached
+        
+        pending, base = self.plan_generation(diff_content)
+        if base:
+            console.print("[dim]Reusing cached changelog for unchanged files[/dim]")
+        
+        messages = self.build_messages(pending)
         client = self.get_client()
         if not client:
             return None
-            
+        
+        # A partial changelog is merged before showing, so only stream full ones
+        echo = base is None
+        chunks = []
+        usage = None
         try:
-            with Progress(
-                SpinnerColumn(),
-                TextColumn("[progress.description]{task.description}"),
-                console=console
-            ) as progress:
-                task = progress.add_task("[green]Generating changelog...", total=None)
-                
-                model = self.config.get('model', 'gpt-3.5-turbo')
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=1000,
-                    temperature=0.3
+            with console.status("[green]Generating changelog...") as status:
+                response = self.create_completion(
+                    client.chat.completions.create,
+                    messages=messages,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **self.completion_options()
                 )
                 
-                progress.update(task, completed=True)
-            
-            return response.choices[0].message.content.strip()
-            
+                for chunk in response:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    
+                    if not chunks:
+                        status.stop()
+                        if echo:
+                            console.print(f"\n[bold green]Generated Changelog:[/bold green]\n{SEPARATOR}")
+                    chunks.append(delta)
+                    if echo:
+                        console.print(delta, end="", markup=False, highlight=False, soft_wrap=True)
         except Exception as e:
+            if chunks and echo:
+                console.print()
             console.print(f"[red]Error: {e}[/red]")
             return None
+        
+        changelog = "".join(chunks).strip()
+        if not changelog:
+            console.print("[red]Error: Empty response from API[/red]")
+            return None
+        
+        if echo:
+            console.print(f"\n{SEPARATOR}")
+        if usage:
+            console.print(f"[dim]Tokens: {usage.prompt_tokens} prompt, {usage.completion_tokens} completion[/dim]")
+        
+        changelog = self.finish_generation(diff_content, base, changelog)
+        if changelog and not echo:
+            self.show_changelog(changelog)
+        return changelog
     
-    def process_file(self, filepath):
-        """Process a diff file and generate changelog"""
-        # Read the file
+    async def _generate_async(self, client, semaphore, diff_content):
+        """Generate changelog from diff content without blocking other requests"""
+        pending, base = self.plan_generation(diff_content)
+        async with semaphore:
+            try:
+                response = await self.create_completion_async(
+                    client.chat.completions.create,
+                    messages=self.build_messages(pending),
+                    **self.completion_options()
+                )
+            except Exception as e:
+                console.print(f"[red]Error: {e}[/red]")
+                return None
+        
+        changelog = (response.choices[0].message.content or "").strip()
+        if not changelog:
+            console.print("[red]Error: Empty response from API[/red]")
+            return None
+        return self.finish_generation(diff_content, base, changelog)
+    
+    def endpoint_key(self):
+        """Identify the configured endpoint and model
+        
+        Hashed, since the URL may carry credentials and the cache is not private.
+        """
+        model = self.config.get('model', 'gpt-3.5-turbo')
+        return hashlib.blake2b(
+            f"{self.get_api_url()}\0{model}".encode(),
+            digest_size=16
+        ).hexdigest()
+    
+    def batch_supported(self):
+        """Check whether the endpoint may accept a list of prompts"""
+        if not self.use_cache:
+            return True
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
+            with open(ENDPOINTS_FILE, 'rb') as f:
+                unsupported = json_loads(f.read())
+        except:
+            return True
+        return self.endpoint_key() not in unsupported
+    
+    def batch_rejected(self, error):
+        """Check whether an error means the endpoint can't take prompt lists"""
+        if not isinstance(error, load_openai().APIStatusError):
+            return False
+        if error.status_code in (404, 405, 501):
+            return True
+        message = str(error).lower()
+        return error.status_code == 400 and any(
+            phrase in message
+            for phrase in ("not supported", "unsupported", "does not support", "chat model")
+        )
+    
+    def mark_batch_unsupported(self):
+        """Remember that the endpoint rejected a list of prompts"""
+        try:
+            with open(ENDPOINTS_FILE, 'rb') as f:
+                unsupported = json_loads(f.read())
+        except:
+            unsupported = []
+        unsupported.append(self.endpoint_key())
+        try:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = ENDPOINTS_FILE.with_suffix(".tmp")
+            with open(tmp, 'wb') as f:
+                f.write(json_dumps(unsupported))
+            tmp.replace(ENDPOINTS_FILE)
+        except OSError:
+            pass
+    
+    async def _generate_batch(self, client, semaphore, contents):
+        """Generate changelogs for several diffs with one request per BATCH_SIZE diffs
+        
+        Uses the legacy completions endpoint, which takes a list of prompts.
+        Returns None if the endpoint does not support it.
+        """
+        plans = [self.plan_generation(content) for content in contents]
+        prompts = [COMPLETION_PROMPT_HEAD + pending + COMPLETION_PROMPT_TAIL for pending, _ in plans]
+        batches = [prompts[i:i + BATCH_SIZE] for i in range(0, len(prompts), BATCH_SIZE)]
+        
+        async def request(batch):
+            async with semaphore:
+                return await self.create_completion_async(
+                    client.completions.create,
+                    prompt=batch,
+                    stop=COMPLETION_STOP,
+                    **self.completion_options()
+                )
+        
+        try:
+            responses = await asyncio.gather(*(request(batch) for batch in batches))
+        except Exception as e:
+            # Chat-only endpoints and models reject the legacy endpoint or a prompt
+            # list; other failures, such as one oversized prompt, are not remembered
+            if self.batch_rejected(e):
+                self.mark_batch_unsupported()
+                console.print(
+                    f"[yellow]Endpoint does not support --batch, sending one request per file "
+                    f"(delete {ENDPOINTS_FILE} to try again)[/yellow]"
+                )
+            else:
+                console.print(f"[red]Error: {e}[/red]")
+            return None
+        
+        # Choices can come back in any order, so match them up by index
+        texts = []
+        for batch, response in zip(batches, responses):
+            ordered = [None] * len(batch)
+            for choice in response.choices:
+                if 0 <= choice.index < len(batch):
+                    ordered[choice.index] = (choice.text or "").strip()
+            if len(response.choices) != len(batch) or None in ordered:
+                console.print(
+                    f"[red]Error: API returned {len(response.choices)} changelogs "
+                    f"for {len(batch)} diffs, retrying one at a time[/red]"
+                )
+                return None
+            texts.extend(ordered)
+        
+        changelogs = []
+        for content, (_, base), text in zip(contents, plans, texts):
+            if not text:
+                console.print("[red]Error: Empty response from API[/red]")
+                changelogs.append(None)
+                continue
+            changelogs.append(self.finish_generation(content, base, text))
+        return changelogs
+    
+    def read_diff(self, filepath):
+        """Read a diff file, returning its content or None on error"""
+        model = self.config.get('model', 'gpt-3.5-turbo')
+        try:
+            with open(filepath, 'rb') as f:
+                st = os.fstat(f.fileno())
+                if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+                    # Map the file so large diffs are scanned without copying them
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        content, trimmed = summarize_diff(mm, model)
+                else:
+                    # Pipes and process substitution can't be mapped
+                    content, trimmed = summarize_diff(f.read(), model)
         except FileNotFoundError:
             console.print(f"[red]Error: File '{filepath}' not found[/red]")
-            return
+            return None
         except Exception as e:
             console.print(f"[red]Error reading file: {e}[/red]")
-            return
+            return None
         
         if not content:
-            console.print("[red]Error: File is empty[/red]")
+            console.print(f"[red]Error: File '{filepath}' is empty[/red]")
+            return None
+        
+        if trimmed:
+            console.print(f"[yellow]'{filepath}' is large, sending only its code changes[/yellow]")
+        return content
+    
+    def show_changelog(self, changelog):
+        """Print a generated changelog"""
+        console.print(f"\n[bold green]Generated Changelog:[/bold green]\n{SEPARATOR}\n{escape(changelog)}\n{SEPARATOR}")
+    
+    def save_changelog(self, filepath, changelog):
+        """Save a changelog next to its diff file"""
+        # Save to file
+        if self.json_output:
+            output_file = Path(filepath).parent / f"changelog-{Path(filepath).stem}.json"
+            text = f"{changelog}\n"
+        else:
+            output_file = Path(filepath).parent / f"changelog-{Path(filepath).stem}.md"
+            text = f"# Changelog\n\n{changelog}"
+        try:
+            # Write beside the target and swap it in so it is never half-written
+            tmp = output_file.with_name(output_file.name + ".tmp")
+            tmp.write_text(text, encoding='utf-8')
+            tmp.replace(output_file)
+            console.print(f"\n[green]✓ Saved to {output_file}[/green]")
+        except Exception as e:
+            console.print(f"[red]Error saving changelog: {e}[/red]")
+    
+    def process_file(self, filepath):
+        """Process a diff file and generate changelog"""
+        content = self.read_diff(filepath)
+        if not content:
             return
         
         # Generate changelog
@@ -234,29 +963,105 @@ Generate a changelog entry:"""
         changelog = self.generate_changelog(content)
         
         if changelog:
-            console.print("\n[bold green]Generated Changelog:[/bold green]")
-            console.print("="*60)
-            console.print(changelog)
-            console.print("="*60)
+            self.save_changelog(filepath, changelog)
+    
+    async def process_files(self, paths):
+        """Process several diff files concurrently"""
+        from rich.progress import Progress, SpinnerColumn, TextColumn
+        
+        settings = self.get_client_settings()
+        if not settings:
+            return
+        
+        # Read files off the event loop, then drop the ones that failed
+        contents = await asyncio.gather(
+            *(asyncio.to_thread(self.read_diff, path) for path in paths)
+        )
+        jobs = [(path, content) for path, content in zip(paths, contents) if content]
+        if not jobs:
+            return
+        
+        changelogs = [self.load_cached(content) for _, content in jobs]
+        todo = [i for i, changelog in enumerate(changelogs) if changelog is None]
+        
+        console.print(f"[blue]Processing {len(jobs)} files...[/blue]")
+        if todo:
+            api_url, api_key = settings
+            openai = load_openai()
+            try:
+                import httpx
+            except ImportError:
+                # Newer openai releases ship the same client as httpx2
+                import httpx2 as httpx
+            client = openai.AsyncOpenAI(
+                base_url=api_url,
+                api_key=api_key,
+                max_retries=0,
+                # Size the pool to the semaphore so every request reuses a connection
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=MAX_CONCURRENCY,
+                        max_keepalive_connections=MAX_CONCURRENCY
+                    )
+                )
+            )
+            semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+            pending = [jobs[i][1] for i in todo]
             
-            # Save to file
-            output_file = Path(filepath).parent / f"changelog-{Path(filepath).stem}.md"
             try:
-                with open(output_file, 'w') as f:
-                    f.write(f"# Changelog\n\n{changelog}")
-                console.print(f"\n[green]✓ Saved to {output_file}[/green]")
-            except Exception as e:
-                console.print(f"[red]Error saving changelog: {e}[/red]")
+                with Progress(
+                    SpinnerColumn(),
+                    TextColumn("[progress.description]{task.description}"),
+                    console=console
+                ) as progress:
+                    task = progress.add_task("[green]Generating changelogs...", total=None)
+                    
+                    # Prefer one request for many diffs, falling back to one request each
+                    generated = None
+                    if self.batch_prompts and len(pending) > 1 and not self.json_output:
+                        if self.batch_supported():
+                            generated = await self._generate_batch(client, semaphore, pending)
+                        else:
+                            console.print(
+                                f"[dim]Skipping --batch, endpoint rejected it before "
+                                f"(delete {ENDPOINTS_FILE} to try again)[/dim]"
+                            )
+                    if generated is None:
+                        generated = await asyncio.gather(
+                            *(self._generate_async(client, semaphore, content) for content in pending)
+                        )
+                    progress.update(task, completed=True)
+            finally:
+                await client.close()
+            
+            for i, changelog in zip(todo, generated):
+                changelogs[i] = changelog
+        
+        for (filepath, _), changelog in zip(jobs, changelogs):
+            if changelog:
+                console.print(f"\n[blue]{filepath}[/blue]")
+                self.show_changelog(changelog)
+                self.save_changelog(filepath, changelog)
 
 def main():
-    app = ChngApp()
+    parser = argparse.ArgumentParser(prog="chng", usage=USAGE.split("\n\n")[0][len("Usage: "):])
+    parser.add_argument("files", nargs="*", metavar="diff_file")
+    parser.add_argument("--setup", action="store_true", help="configure API settings")
+    parser.add_argument("--no-cache", action="store_true", help="regenerate instead of reusing cached changelogs")
+    parser.add_argument("--json", action="store_true", help="write the changelog as JSON instead of markdown")
+    parser.add_argument("--batch", action="store_true", help="send several diffs per request (needs a /completions endpoint)")
+    args = parser.parse_args()
     
-    # Parse simple command line
-    if len(sys.argv) < 2:
-        console.print("Usage: chng <diff_file> or chng --setup")
+    if not args.setup and not args.files:
+        sys.stderr.write(USAGE)
         sys.exit(1)
     
-    if sys.argv[1] == "--setup":
+    app = ChngApp()
+    app.use_cache = not args.no_cache
+    app.json_output = args.json
+    app.batch_prompts = args.batch
+    
+    if args.setup:
         app.setup()
     else:
         # Check if API is configured
@@ -264,8 +1069,10 @@ def main():
             console.print("[yellow]No API configuration found. Running setup...[/yellow]\n")
             app.setup()
             console.print("\n[blue]Now you can run: chng <diff_file>[/blue]")
+        elif len(args.files) == 1:
+            app.process_file(args.files[0])
         else:
-            app.process_file(sys.argv[1])
+            asyncio.run(app.process_files(args.files))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file